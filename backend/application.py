@@ -1,22 +1,154 @@
-from openai import OpenAI
-from flask import Flask, request, jsonify
-import PyPDF2
+import openai
+from openai import AsyncOpenAI
+from flask import Flask, Request, request, jsonify
+from tempfile import SpooledTemporaryFile
+import pypdfium2 as pdfium
 import os
+import asyncio
+import threading
 from dotenv import load_dotenv
 from flask_cors import CORS
 import logging
-import json
-import re
-import requests
+import orjson
+import ijson
+import httpx
 import time
+import hashlib
+from functools import lru_cache
+from cachetools import TTLCache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import tiktoken
+from aiolimiter import AsyncLimiter
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from pdf_extraction import extract_page_range
 
 # -------------------- CONFIG --------------------
 load_dotenv()  # Load environment variables from .env
 
+# Keep tiktoken's downloaded encodings next to the app rather than in the system
+# temp folder, so they survive reboots and can be shipped with a deployment
+os.environ.setdefault(
+    "TIKTOKEN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tiktoken_cache")
+)
+
 # OpenAI client setup
-client = OpenAI()
+client = AsyncOpenAI()
+
+# Model used for all CV comparisons
+GPT_MODEL = "gpt-4o-mini"
+
+# OpenAI rate limits for gpt-4o-mini, enforced per process and shared by every
+# request it serves. gunicorn.conf.py sets them to each worker's share of the
+# account limits; the defaults are the whole account for a single dev server.
+GPT_REQUESTS_PER_MINUTE = int(os.getenv("GPT_REQUESTS_PER_MINUTE", "500"))
+GPT_TOKENS_PER_MINUTE = int(os.getenv("GPT_TOKENS_PER_MINUTE", "200000"))
+rpm_limiter = AsyncLimiter(GPT_REQUESTS_PER_MINUTE, 60)
+tpm_limiter = AsyncLimiter(GPT_TOKENS_PER_MINUTE, 60)
+
+# Rough number of completion tokens GPT writes per CV, counted towards the TPM budget
+GPT_OUTPUT_TOKENS_PER_CV = 600
+
+# Maximum number of GPT requests in flight at once for a single upload
+MAX_CONCURRENT_GPT_CALLS = 10
+
+# Maximum number of CVs packed into a single GPT request
+MAX_CVS_PER_GPT_CALL = 10
+
+# Prompt size budget per GPT request, in tokens (well under gpt-4o-mini's 128k
+# token context). Larger uploads are split into more batches.
+MAX_PROMPT_TOKENS_PER_GPT_CALL = 100_000
+
+# Map frontend request params to GPT keys
+KEY_MAP = {
+    "percentage": "match_percentage",
+    "similarities": "similarities",
+    "missing": "missing",
+    "courses": "course_recommendations",
+    "all": "all"
+}
+ALL_GPT_KEYS = [key for key in KEY_MAP.values() if key != "all"]
+
+# Structured JSON response format for GPT
+PROMPT_STRING = '''
+- "index": The number of the CV this result is for, as shown in its ---CV n--- header
+- "match_percentage": Number (e.g., 70)
+- "similarities": List of matching skills/qualifications
+- "missing": List of skills/requirements missing from the CV
+- "course_recommendations": A list of objects. Each object should have:
+    - "name": a short course title related to a missing skill
+    - "url": a direct link to one relevant course online
+    - If no course is available, include a "topics_to_cover" field instead with 2–3 topic suggestions
+'''
+
+# Static part of the system message; the JD is appended per request
+SYSTEM_INSTRUCTIONS = f"""You are a helpful assistant.
+
+The user will send one or more CVs, each under a ---CV n--- header. Analyze the match between the job description below and each CV. Return a JSON object of the form {{"results": [...]}} containing one object per CV, each with the following keys:
+
+{PROMPT_STRING}
+
+Only respond with the JSON object. If a course URL is not available for a missing skill, suggest relevant 'topics_to_cover' instead.
+"""
+
+# Filtered GPT feedback per (JD, CV, selected params), so re-uploading the same
+# files skips the GPT call and URL checks. Process-local, entries expire after a day.
+feedback_cache = TTLCache(maxsize=10_000, ttl=86400)
+
+# Shared async HTTP client for course URL checks. Runs on the background event
+# loop; HTTP/2 multiplexes concurrent HEAD requests to the same course site over
+# one pooled connection.
+url_check_client = httpx.AsyncClient(
+    http2=True,
+    timeout=3.0,
+    follow_redirects=True,
+    limits=httpx.Limits(max_connections=100)
+)
+
+# Recent results of course URLs checked by this process (GPT often suggests the same
+# courses). Entries expire after a day, since courses move or come back online.
+url_check_cache = TTLCache(maxsize=10_000, ttl=86400)
+
+# PDFium is not thread-safe, so the page counting request threads do in this
+# process is serialized. Text extraction itself happens in the pool below.
+pdfium_lock = threading.Lock()
+
+# PDF text is extracted by worker processes, in chunks of up to this many pages,
+# so several uploads and the pages of long documents are read in parallel. The
+# workers are spawned, so they don't inherit PDFium state from a thread that was
+# mid-call when forking. PDF_EXTRACTION_WORKERS sizes the pool per process
+# (gunicorn.conf.py splits the CPUs between workers).
+PAGES_PER_EXTRACTION_CHUNK = 10
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", os.cpu_count()))
+
+def new_page_extraction_pool():
+    return ProcessPoolExecutor(
+        max_workers=PDF_EXTRACTION_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+
+# Replaced by restart_page_extraction_pool if one of its workers dies
+page_extraction_pool = new_page_extraction_pool()
+page_extraction_pool_lock = threading.Lock()
+
+# Background event loop that runs all async GPT work. Flask views are sync, and
+# the async client keeps pooled connections tied to the loop that opened them,
+# so one long-lived loop is shared instead of calling asyncio.run per request.
+event_loop = asyncio.new_event_loop()
+threading.Thread(target=event_loop.run_forever, daemon=True).start()
+
+# Uploads are held in memory up to this size per file before spilling to disk.
+# Werkzeug's default is 500 KB, which sends most multi-CV uploads to temp files.
+UPLOAD_MEMORY_LIMIT = 10 * 1024 * 1024
+
+# Keep uploaded CVs in RAM instead of temp files
+class InMemoryUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=UPLOAD_MEMORY_LIMIT, mode="rb+")
 
 application = Flask(__name__)
+application.request_class = InMemoryUploadRequest
+application.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # JD + a batch of CVs
 CORS(application, origins=["http://localhost:3570"])  # Allow frontend to connect
 
 # Debugging: Print partial OpenAI key for verification
@@ -36,116 +168,565 @@ logger = logging.getLogger(__name__)
 # -------------------- HELPERS --------------------
 
 # Validate if a given URL is reachable
-def is_valid_url(url):
+async def is_valid_url(url):
+    if not isinstance(url, str) or not url:
+        return False
+    if url in url_check_cache:
+        return url_check_cache[url]
     try:
-        response = requests.head(url, timeout=5, allow_redirects=True)
-        return response.status_code == 200
-    except requests.RequestException:
+        response = await url_check_client.head(url)
+    except (httpx.HTTPError, httpx.InvalidURL):
+        # Timeouts and connection errors may be transient, so they aren't cached
         return False
+    valid = response.status_code == 200
+    # Neither are rate limiting and server errors
+    if response.status_code != 429 and response.status_code < 500:
+        url_check_cache[url] = valid
+    return valid
+
+# Build a JSON response with orjson, which is much faster than jsonify on large result lists
+def json_response(payload):
+    return application.response_class(orjson.dumps(payload), mimetype='application/json')
+
+# Run a coroutine on the background event loop and wait for its result
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, event_loop).result()
 
 # Health check route
 @application.route('/')
 def index():
     return "Backend is running"
 
-# Extract text from a PDF file
-def extract_text_from_pdf(pdf_file):
+# Read an uploaded PDF file. Returns its bytes and page count.
+def read_pdf(pdf_file):
+    pdf_file.seek(0)
+    pdf_bytes = pdf_file.read()
+    with pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            page_count = len(pdf)
+        finally:
+            pdf.close()
+    return pdf_bytes, page_count
+
+# Replace the extraction pool after one of its workers died (a crash, an OOM kill
+# or a PDF that segfaults PDFium), which leaves a ProcessPoolExecutor unusable for good.
+# Only the first thread to notice replaces it.
+def restart_page_extraction_pool(broken_pool):
+    global page_extraction_pool
+    with page_extraction_pool_lock:
+        if page_extraction_pool is broken_pool:
+            logger.warning("PDF extraction worker died, restarting the extraction pool")
+            page_extraction_pool = new_page_extraction_pool()
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+# Start extracting the text of a PDF in the worker processes.
+# Returns the pool used and the futures for its chunks of pages, in page order.
+def submit_pdf_extraction(pdf_bytes, page_count):
+    pool = page_extraction_pool
     try:
-        reader = PyPDF2.PdfReader(pdf_file)
-        text = ''
-        for page in reader.pages:
-            text += page.extract_text()
-        logger.info('PDF text extraction successful')
-        return text
-    except Exception as e:
-        logger.error(f"Error extracting text from PDF: {e}")
+        return pool, [
+            pool.submit(
+                extract_page_range, pdf_bytes, start,
+                min(start + PAGES_PER_EXTRACTION_CHUNK, page_count)
+            )
+            for start in range(0, page_count, PAGES_PER_EXTRACTION_CHUNK)
+        ]
+    except BrokenProcessPool:
+        restart_page_extraction_pool(pool)
+        raise
+
+# Wait for the text of a PDF submitted with submit_pdf_extraction
+def collect_pdf_text(pool, futures):
+    try:
+        return '\n'.join(text for future in futures for text in future.result())
+    except BrokenProcessPool:
+        restart_page_extraction_pool(pool)
         raise
 
-# Compare one CV against a JD using GPT
-def compare_with_gpt_for_many_cvs(job_description, cv_text, selected_params):
+# Raised when a batch of CVs does not fit in one GPT request or response
+class BatchTooLargeError(Exception):
+    pass
+
+# Keep only the requested feedback keys and drop unreachable course URLs.
+# url_checks maps each URL already being checked in this request to its check,
+# so a course recommended for several CVs is only requested once.
+async def filter_feedback(feedback_full, selected_params, url_checks):
+    # Filter feedback by requested params
+    if "all" in selected_params:
+        selected_keys = ALL_GPT_KEYS
+    else:
+        selected_keys = [KEY_MAP[p] for p in selected_params if p in KEY_MAP]
+
+    feedback_filtered = {
+        key: feedback_full.get(key)
+        for key in selected_keys
+        if feedback_full.get(key) is not None
+    }
+
+    # Validate course URLs before returning, all at once
+    if "course_recommendations" in feedback_filtered:
+        courses = feedback_filtered["course_recommendations"]
+        # Skip malformed entries rather than failing the whole CV
+        if not isinstance(courses, list):
+            courses = []
+        courses = [course for course in courses if isinstance(course, dict)]
+        urls = [course.get("url", "") for course in courses]
+        for url in urls:
+            if url not in url_checks:
+                url_checks[url] = asyncio.ensure_future(is_valid_url(url))
+        # Shielded, so cancelling one CV's filtering leaves checks other CVs share running
+        valid_mask = await asyncio.gather(
+            *(asyncio.shield(url_checks[url]) for url in urls)
+        )
+        feedback_filtered["course_recommendations"] = [
+            course for course, valid in zip(courses, valid_mask) if valid
+        ]
+
+    return feedback_filtered
+
+# Tokenizer for gpt-4o-mini, loaded on first use (tiktoken downloads it once)
+@lru_cache(maxsize=None)
+def get_token_encoding():
+    return tiktoken.encoding_for_model(GPT_MODEL)
+
+# Seconds to wait before trying to load the tokenizer again after a failure
+TOKENIZER_RETRY_INTERVAL = 300
+tokenizer_retry_at = 0.0
+
+# Get the tokenizer from async code, or None if it can't be loaded right now. The
+# first load is a blocking download, so it runs in a worker thread instead of
+# stalling every stream on the event loop. A failed download is retried at most
+# every TOKENIZER_RETRY_INTERVAL seconds rather than on every request.
+async def load_token_encoding():
+    global tokenizer_retry_at
+    if time.monotonic() < tokenizer_retry_at:
+        return None
+    try:
+        return await asyncio.to_thread(get_token_encoding)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, estimating token counts instead: {e}")
+        tokenizer_retry_at = time.monotonic() + TOKENIZER_RETRY_INTERVAL
+        return None
+
+# Count the tokens GPT will see for a piece of text. Special-token markers such as
+# <|endoftext|> in a CV are counted as plain text instead of raising. Without a
+# tokenizer the count is estimated from the length (English runs about 4
+# characters per token; 3 leaves headroom), which is close enough to size
+# batches and throttle.
+def count_tokens(encoding, text):
+    if encoding is None:
+        return len(text) // 3
+    return len(encoding.encode_ordinary(text))
+
+# Stream a chat completion once the RPM and TPM budgets allow it, calling
+# on_result with each object of the response's "results" list as soon as it has
+# been fully generated. Returns the completion's finish_reason.
+# Rate limit, connection and server errors are retried with randomized exponential backoff.
+@retry(
+    retry=retry_if_exception_type(
+        (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+    ),
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(5),
+    reraise=True
+)
+async def create_chat_completion(messages, estimated_tokens, on_result):
+    async with rpm_limiter:
+        await tpm_limiter.acquire(min(estimated_tokens, GPT_TOKENS_PER_MINUTE))
+    # The SDK's own retries are turned off here, so rate-limited calls go back
+    # through the limiters and the backoff above instead of retrying immediately
+    stream = await client.with_options(max_retries=0).chat.completions.create(
+        model=GPT_MODEL,
+        messages=messages,
+        response_format={"type": "json_object"},
+        stream=True
+    )
+
+    # Parse the JSON incrementally as chunks arrive
+    results = ijson.sendable_list()
+    parser = ijson.items_coro(results, "results.item", use_float=True)
+    finish_reason = None
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.delta.content:
+            parser.send(choice.delta.content.encode())
+            for result in results:
+                on_result(result)
+            del results[:]
+        finish_reason = choice.finish_reason or finish_reason
+
+    # A response cut off at the token limit is incomplete JSON, the caller handles it
+    if finish_reason != "length":
+        parser.close()
+    return finish_reason
+
+# Build the system message for a JD. It holds the instructions and the JD text
+# and is identical for every batch in a request, so OpenAI's prompt caching can
+# reuse it as a prefix; only the CVs in the user message change between calls.
+def build_system_message(job_description):
+    return {"role": "system", "content": f"{SYSTEM_INSTRUCTIONS}\nJob Description: {job_description}\n"}
+
+# Compare a batch of CVs against a JD in a single GPT request. estimated_tokens is
+# the caller's token count for the request, used for TPM throttling.
+# Returns one feedback dict (or the exception for that CV) per CV, in input order.
+async def compare_with_gpt_for_many_cvs(system_message, cv_texts, selected_params, estimated_tokens, url_checks):
     start_time = time.time()
     try:
-        # Structured JSON response format for GPT
-        prompt_string = '''
-- "match_percentage": Number (e.g., 70)
-- "similarities": List of matching skills/qualifications
-- "missing": List of skills/requirements missing from the CV
-- "course_recommendations": A list of objects. Each object should have:
-    - "name": a short course title related to a missing skill
-    - "url": a direct link to one relevant course online
-    - If no course is available, include a "topics_to_cover" field instead with 2–3 topic suggestions
-'''
+        cv_sections = "\n\n".join(
+            f"---CV {i}---\n{cv_text}" for i, cv_text in enumerate(cv_texts)
+        )
 
         # Messages for GPT prompt
         messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": f"""
-Job Description: {job_description}
-
-CV Content: {cv_text}
-
-Analyze the match between the job description and the CV. Return a JSON object with the following keys:
-
-{prompt_string}
-
-Only respond with the JSON object. If a course URL is not available for a missing skill, suggest relevant 'topics_to_cover' instead.
-"""}
+            system_message,
+            {"role": "user", "content": cv_sections}
         ]
 
-        # Send request to OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", messages=messages
-        )
-
-        # Extract raw response from GPT
-        feedback_raw = response.choices[0].message.content.strip()
+        # Start filtering (and URL checks) for each CV while GPT is still writing the rest
+        filter_tasks = {}
 
-        # Extract JSON object from GPT response
-        match = re.search(r"\{.*\}", feedback_raw, re.DOTALL)
-        if not match:
-            logger.error("No JSON object found in GPT response.")
-            raise ValueError("Invalid response format from GPT")
+        def on_result(result):
+            # Ignore malformed results, their CVs get the "no result" error below
+            if not isinstance(result, dict):
+                return
+            index = result.get("index")
+            # bool is an int subclass, so True would otherwise stand in for CV 1
+            if type(index) is int and 0 <= index < len(cv_texts) and index not in filter_tasks:
+                filter_tasks[index] = asyncio.create_task(
+                    filter_feedback(result, selected_params, url_checks)
+                )
 
-        feedback_full = json.loads(match.group(0))
+        try:
+            finish_reason = await create_chat_completion(messages, estimated_tokens, on_result)
+        except openai.BadRequestError as e:
+            if e.code == "context_length_exceeded":
+                raise BatchTooLargeError(str(e)) from e
+            raise
+        except Exception:
+            # Drop checks started for a response that never completed
+            for task in filter_tasks.values():
+                task.cancel()
+            raise
+
+        # A truncated response cannot be parsed, so treat it like an oversized batch
+        if finish_reason == "length":
+            for task in filter_tasks.values():
+                task.cancel()
+            raise BatchTooLargeError("GPT response was cut off at the output token limit")
+
+        feedbacks = []
+        for i in range(len(cv_texts)):
+            if i not in filter_tasks:
+                feedbacks.append(ValueError("No result returned by GPT for this CV"))
+                continue
+            try:
+                feedbacks.append(await filter_tasks[i])
+            except Exception as e:
+                feedbacks.append(e)
+
+        return feedbacks
 
-        # Map frontend request params to GPT keys
-        key_map = {
-            "percentage": "match_percentage",
-            "similarities": "similarities",
-            "missing": "missing",
-            "courses": "course_recommendations",
-            "all": "all"
-        }
+    except Exception as e:
+        logger.error(f"Error in GPT-3 API request (many CVs): {e}")
+        raise
+    finally:
+        end_time = time.time()
+        duration = end_time - start_time
+        logger.info(f"Processed {len(cv_texts)} CVs in one GPT request in {duration:.2f} seconds")
+
+# Extract text from several PDFs, all submitted to the worker processes at once.
+# Returns the text (or the exception raised) for each file, in input order.
+def extract_pdf_texts(pdf_files):
+    pdfs = []
+    extractions = []
+    for pdf_file in pdf_files:
+        try:
+            pdf = read_pdf(pdf_file)
+            extraction = submit_pdf_extraction(*pdf)
+        except BrokenProcessPool as e:
+            extraction = e  # resubmitted below
+        except Exception as e:
+            pdf = extraction = e
+        pdfs.append(pdf)
+        extractions.append(extraction)
 
-        # Filter feedback by requested params
-        if "all" in selected_params:
-            selected_keys = list(key_map.values())[:-1]  # all except 'all'
+    pdf_texts = []
+    for pdf, extraction in zip(pdfs, extractions):
+        try:
+            if isinstance(pdf, Exception):
+                raise pdf
+            try:
+                if isinstance(extraction, Exception):
+                    raise extraction
+                text = collect_pdf_text(*extraction)
+            except BrokenProcessPool:
+                # The pool has been restarted, so give this file one more try
+                logger.warning("PDF extraction worker died, retrying the file")
+                text = collect_pdf_text(*submit_pdf_extraction(*pdf))
+            logger.info('PDF text extraction successful')
+            pdf_texts.append(text)
+        except Exception as e:
+            logger.error(f"Error extracting text from PDF: {e}")
+            pdf_texts.append(e)
+    return pdf_texts
+
+# Cache key for one JD/CV comparison with the given params
+def feedback_cache_key(job_description, cv_text, selected_params):
+    payload = orjson.dumps([job_description, cv_text, sorted(selected_params)])
+    return hashlib.sha256(payload).hexdigest()
+
+# Group CV indexes into batches small enough for a single GPT request,
+# given the system prompt's token count and each CV's token count
+def batch_cv_indexes(system_tokens, cv_tokens, indexes):
+    batches = []
+    batch = []
+    batch_tokens = system_tokens
+    for i in indexes:
+        if batch and (
+            len(batch) >= MAX_CVS_PER_GPT_CALL
+            or batch_tokens + cv_tokens[i] > MAX_PROMPT_TOKENS_PER_GPT_CALL
+        ):
+            batches.append(batch)
+            batch = []
+            batch_tokens = system_tokens
+        batch.append(i)
+        batch_tokens += cv_tokens[i]
+    if batch:
+        batches.append(batch)
+    return batches
+
+# Compare every CV against the JD, several CVs per GPT request, batches in parallel.
+# Returns one feedback dict (or the exception raised) per CV, in input order.
+async def compare_many_cvs(job_description, cv_texts, selected_params):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_GPT_CALLS)
+    system_message = build_system_message(job_description)
+    feedbacks = list(cv_texts)  # CVs that failed extraction keep their exception
+    url_checks = {}  # shared by every batch, see filter_feedback
+
+    async def compare_batch(batch):
+        estimated_tokens = system_tokens + sum(
+            cv_tokens[i] + GPT_OUTPUT_TOKENS_PER_CV for i in batch
+        )
+        try:
+            async with semaphore:
+                batch_feedbacks = await compare_with_gpt_for_many_cvs(
+                    system_message, [cv_texts[i] for i in batch], selected_params,
+                    estimated_tokens, url_checks
+                )
+        except BatchTooLargeError as e:
+            if len(batch) > 1:
+                # Fall back to two smaller requests
+                half = len(batch) // 2
+                logger.warning(f"Batch of {len(batch)} CVs too large for one GPT request, splitting")
+                await asyncio.gather(compare_batch(batch[:half]), compare_batch(batch[half:]))
+                return
+            batch_feedbacks = [e]
+        except Exception as e:
+            batch_feedbacks = [e] * len(batch)
+        for i, feedback in zip(batch, batch_feedbacks):
+            feedbacks[i] = feedback
+            if not isinstance(feedback, Exception):
+                feedback_cache[cache_keys[i]] = orjson.dumps(feedback)
+
+    # Serve repeated comparisons from the cache, only send the rest to GPT
+    cache_keys = {}
+    pending = []
+    for i, cv_text in enumerate(cv_texts):
+        if isinstance(cv_text, Exception):
+            continue
+        cache_keys[i] = feedback_cache_key(job_description, cv_text, selected_params)
+        cached = feedback_cache.get(cache_keys[i])
+        if cached is not None:
+            feedbacks[i] = orjson.loads(cached)
         else:
-            selected_keys = [key_map[p] for p in selected_params if p in key_map]
+            pending.append(i)
+    if len(pending) < len(cache_keys):
+        logger.info(f"Feedback cache hit for {len(cache_keys) - len(pending)} of {len(cache_keys)} CVs")
+
+    if not pending:
+        return feedbacks
+
+    # Tokenize the JD prompt and each CV once, for both batch sizing and throttling.
+    # A CV that can't be tokenized fails on its own, not the whole request.
+    encoding = await load_token_encoding()
+    system_tokens = count_tokens(encoding, system_message["content"])
+    cv_tokens = {}
+    for i in pending:
+        try:
+            cv_tokens[i] = count_tokens(encoding, cv_texts[i])
+        except Exception as e:
+            logger.error(f"Error tokenizing CV {i}: {e}")
+            feedbacks[i] = e
+
+    await asyncio.gather(
+        *(compare_batch(batch) for batch in batch_cv_indexes(system_tokens, cv_tokens, list(cv_tokens)))
+    )
+    return feedbacks
+
+# Parse the selectedOptions form field, a JSON list such as ["percentage", "missing"]
+def parse_selected_params(raw_options):
+    selected_params = orjson.loads(raw_options or "[]")
+    if not isinstance(selected_params, list) or not all(
+        isinstance(param, str) for param in selected_params
+    ):
+        raise ValueError("selectedOptions must be a JSON list of strings")
+    return selected_params
+
+# Build result table rows, one per CV, with a column for each selected param
+def build_table_rows(cv_names, feedbacks, selected_params):
+    # Resolve columns and their GPT keys once for the whole table
+    if "all" in selected_params:
+        columns = [param for param in KEY_MAP if param != "all"]
+    else:
+        columns = [param for param in selected_params if param in KEY_MAP]
+    gpt_keys = [KEY_MAP[param] for param in columns]
 
-        feedback_filtered = {
-            key: feedback_full.get(key)
-            for key in selected_keys
-            if feedback_full.get(key) is not None
+    table_data = []
+    for cv_name, feedback in zip(cv_names, feedbacks):
+        if isinstance(feedback, Exception):
+            logger.error(f"Error processing {cv_name}: {feedback}")
+            row = {'cv_name': cv_name, 'error': str(feedback)}
+            for param in columns:
+                row[param] = 'Error'
+            table_data.append(row)
+            continue
+
+        # Build a row of results for the table
+        row = {'cv_name': cv_name}
+        for param, gpt_key in zip(columns, gpt_keys):
+            value = feedback.get(gpt_key)
+
+            # Format output values
+            if param == "percentage":
+                value = f"{value}%" if value is not None else "N/A"
+            elif isinstance(value, list):
+                value = ', '.join(map(str, value))
+            elif isinstance(value, dict):
+                value = orjson.dumps(value).decode()
+            else:
+                value = str(value) if value is not None else "N/A"
+
+            row[param] = value
+
+        table_data.append(row)
+    return table_data
+
+# Batch metadata allows 16 keys of up to 512 characters each. One holds the selected
+# options; the CVs that failed extraction are stored as a JSON list split across the rest.
+BATCH_METADATA_VALUE_LENGTH = 512
+BATCH_METADATA_FAILED_CV_KEYS = 15
+BATCH_FAILED_CV_ERROR_LENGTH = 100
+
+# Encode (cv index, filename, exception) entries for the batch metadata. If they don't
+# fit, error messages are dropped first, then the entries that still don't fit.
+def encode_failed_cvs(failed_cvs):
+    max_length = BATCH_METADATA_VALUE_LENGTH * BATCH_METADATA_FAILED_CV_KEYS
+    entries = [[i, cv_name, str(e)[:BATCH_FAILED_CV_ERROR_LENGTH]] for i, cv_name, e in failed_cvs]
+    encoded = orjson.dumps(entries).decode()
+    if len(encoded) > max_length:
+        entries = [[i, cv_name, ""] for i, cv_name, _ in failed_cvs]
+        encoded = orjson.dumps(entries).decode()
+    while len(encoded) > max_length:
+        entries.pop()
+        encoded = orjson.dumps(entries).decode()
+    if len(entries) < len(failed_cvs):
+        logger.warning(f"Only {len(entries)} of {len(failed_cvs)} failed CVs fit in the batch metadata")
+
+    return {
+        f"failed_cvs_{n}": encoded[start:start + BATCH_METADATA_VALUE_LENGTH]
+        for n, start in enumerate(range(0, len(encoded), BATCH_METADATA_VALUE_LENGTH))
+    }
+
+# Read back the (cv index, filename, error) entries stored by encode_failed_cvs
+def decode_failed_cvs(metadata):
+    encoded = "".join(
+        metadata.get(f"failed_cvs_{n}", "") for n in range(BATCH_METADATA_FAILED_CV_KEYS)
+    )
+    entries = orjson.loads(encoded) if encoded else []
+    return [
+        (i, cv_name, ValueError(error or "Text extraction failed"))
+        for i, cv_name, error in entries
+    ]
+
+# Submit one GPT request per CV to the OpenAI Batch API (half price, done within 24h).
+# Each request's custom_id is "<cv index>:<filename>" so results can be matched back
+# without keeping any state on this server. CVs that failed extraction (exceptions in
+# cv_texts) are not submitted but recorded in the batch metadata, so polling returns
+# the full table.
+async def submit_batch_job(job_description, cv_names, cv_texts, selected_params):
+    system_message = build_system_message(job_description)
+    lines = []
+    failed_cvs = []
+    for i, (cv_name, cv_text) in enumerate(zip(cv_names, cv_texts)):
+        if isinstance(cv_text, Exception):
+            failed_cvs.append((i, cv_name, cv_text))
+            continue
+        lines.append(orjson.dumps({
+            "custom_id": f"{i}:{cv_name}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": GPT_MODEL,
+                "messages": [system_message, {"role": "user", "content": f"---CV 0---\n{cv_text}"}],
+                "response_format": {"type": "json_object"}
+            }
+        }))
+
+    input_file = await client.files.create(
+        file=("batch_input.jsonl", b"\n".join(lines)), purpose="batch"
+    )
+    return await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={
+            "selected_options": orjson.dumps(selected_params).decode(),
+            **encode_failed_cvs(failed_cvs)
         }
+    )
+
+# Read a finished batch job's output and error files into table rows, in CV order
+async def fetch_batch_results(batch):
+    selected_params = orjson.loads(batch.metadata["selected_options"])
+
+    outputs = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            content = await client.files.content(file_id)
+            outputs.extend(orjson.loads(line) for line in content.content.splitlines() if line)
+
+    rows = []
+    for output in outputs:
+        index, cv_name = output["custom_id"].split(":", 1)
+        response = output.get("response") or {}
+        try:
+            if output.get("error") or response.get("status_code") != 200:
+                error = output.get("error") or response.get("body", {}).get("error")
+                raise ValueError(f"Batch request failed: {error}")
+            feedback_raw = response["body"]["choices"][0]["message"]["content"]
+            feedback = orjson.loads(feedback_raw).get("results", [{}])[0]
+        except Exception as e:
+            feedback = e
+        rows.append((int(index), cv_name, feedback))
+    rows.extend(decode_failed_cvs(batch.metadata))
+    rows.sort(key=lambda row: row[0])
 
-        # Validate course URLs before returning
-        if "course_recommendations" in feedback_filtered:
-            valid_courses = []
-            for course in feedback_filtered["course_recommendations"]:
-                if is_valid_url(course.get("url", "")):
-                    valid_courses.append(course)
-            feedback_filtered["course_recommendations"] = valid_courses
+    # Filter every CV concurrently, checking each recommended course URL once
+    url_checks = {}
 
-        return feedback_filtered
+    async def filter_row(feedback):
+        if isinstance(feedback, Exception):
+            return feedback
+        try:
+            return await filter_feedback(feedback, selected_params, url_checks)
+        except Exception as e:
+            return e
 
-    except Exception as e:
-        logger.error(f"Error in GPT-3 API request (many CVs): {e}")
-        raise
-    finally:
-        end_time = time.time()
-        duration = end_time - start_time
-        logger.info(f"Processed one CV in {duration:.2f} seconds")
+    feedbacks = await asyncio.gather(*(filter_row(feedback) for _, _, feedback in rows))
+    return build_table_rows([cv_name for _, cv_name, _ in rows], feedbacks, selected_params)
 
 # -------------------- ROUTES --------------------
 
@@ -156,7 +737,6 @@ def analyze_many_cvs():
     Returns a list of results with feedback for each CV.
     """
     jd_file = request.files.get('job_description')
-    selected_params = request.form.get('selectedOptions')
     files = request.files.getlist('cvs')
 
     if not jd_file or not files:
@@ -164,35 +744,40 @@ def analyze_many_cvs():
         return jsonify({'error': 'Missing data'}), 400
 
     try:
-        job_description = extract_text_from_pdf(jd_file)
-    except Exception as e:
-        logger.error(f"Error processing JD file: {e}")
-        return jsonify({'error': f"Error processing JD file: {str(e)}"}), 500
+        selected_params = parse_selected_params(request.form.get('selectedOptions'))
+    except ValueError as e:
+        logger.error(f"Invalid selectedOptions: {e}")
+        return jsonify({'error': f"Invalid selectedOptions: {str(e)}"}), 400
 
-    results = []
+    start_time = time.time()
 
-    # Process each CV
-    for file in files:
-        start_time = time.time()
-        try:
-            cv_text = extract_text_from_pdf(file)
-            feedback = compare_with_gpt_for_many_cvs(job_description, cv_text, selected_params)
+    # Extract the JD and all CVs together
+    pdf_texts = extract_pdf_texts([jd_file.stream, *(file.stream for file in files)])
+    job_description, cv_texts = pdf_texts[0], pdf_texts[1:]
+    if isinstance(job_description, Exception):
+        logger.error(f"Error processing JD file: {job_description}")
+        return jsonify({'error': f"Error processing JD file: {str(job_description)}"}), 500
+
+    feedbacks = run_async(compare_many_cvs(job_description, cv_texts, selected_params))
+
+    results = []
+    for file, feedback in zip(files, feedbacks):
+        if isinstance(feedback, Exception):
+            logger.error(f"Error processing {file.filename}: {feedback}")
             results.append({
                 'filename': file.filename,
-                'feedback': feedback
+                'error': str(feedback)
             })
-        except Exception as e:
-            logger.error(f"Error processing {file.filename}: {e}")
+        else:
             results.append({
                 'filename': file.filename,
-                'error': str(e)
+                'feedback': feedback
             })
-        finally:
-            end_time = time.time()
-            duration = end_time - start_time
-            logger.info(f"[/analyzeManyCvs] {file.filename} processed in {duration:.2f} seconds")
 
-    return jsonify({'results': results}), 200
+    duration = time.time() - start_time
+    logger.info(f"[/analyzeManyCvs] {len(files)} CVs processed in {duration:.2f} seconds")
+
+    return json_response({'results': results}), 200
 
 
 @application.route('/analyzeManyCvsTableWithParams', methods=['POST'])
@@ -202,7 +787,6 @@ def analyze_many_cvs_table_with_params():
     Only the selected parameters are included (percentage, similarities, etc.).
     """
     jd_file = request.files.get('job_description')
-    selected_params = request.form.get('selectedOptions')
     files = request.files.getlist('cvs')
 
     if not jd_file or not files:
@@ -210,53 +794,79 @@ def analyze_many_cvs_table_with_params():
         return jsonify({'error': 'Missing data'}), 400
 
     try:
-        job_description = extract_text_from_pdf(jd_file)
-    except Exception as e:
-        logger.error(f"Error processing JD file: {e}")
-        return jsonify({'error': f"Error processing JD file: {str(e)}"}), 500
+        selected_params = parse_selected_params(request.form.get('selectedOptions'))
+    except ValueError as e:
+        logger.error(f"Invalid selectedOptions: {e}")
+        return jsonify({'error': f"Invalid selectedOptions: {str(e)}"}), 400
 
-    table_data = []
+    start_time = time.time()
+
+    # Extract the JD and all CVs together
+    pdf_texts = extract_pdf_texts([jd_file.stream, *(file.stream for file in files)])
+    job_description, cv_texts = pdf_texts[0], pdf_texts[1:]
+    if isinstance(job_description, Exception):
+        logger.error(f"Error processing JD file: {job_description}")
+        return jsonify({'error': f"Error processing JD file: {str(job_description)}"}), 500
+
+    cv_names = [file.filename for file in files]
+
+    # Non-interactive bulk jobs can go through the Batch API instead.
+    # CVs that failed extraction are reported right away as error rows, and again
+    # in the full table returned by /batchResult.
+    if request.args.get('batch') == 'true':
+        failed = [i for i, cv_text in enumerate(cv_texts) if isinstance(cv_text, Exception)]
+        failed_rows = build_table_rows(
+            [cv_names[i] for i in failed], [cv_texts[i] for i in failed], selected_params
+        )
+        if len(failed) == len(cv_texts):
+            return json_response({'table_data': failed_rows}), 200
 
-    # Process each CV
-    for file in files:
-        start_time = time.time()
         try:
-            cv_text = extract_text_from_pdf(file)
-            feedback = compare_with_gpt_for_many_cvs(job_description, cv_text, selected_params)
-
-            # Build a row of results for the table
-            row = {'cv_name': file.filename}
-            for param in selected_params:
-                value = feedback.get(param)
-
-                # Format output values
-                if param == "percentage":
-                    value = f"{value}%" if value is not None else "N/A"
-                elif isinstance(value, list):
-                    value = ', '.join(map(str, value))
-                elif isinstance(value, dict):
-                    value = json.dumps(value)
-                else:
-                    value = str(value) if value is not None else "N/A"
-
-                row[param] = value
+            batch = run_async(submit_batch_job(job_description, cv_names, cv_texts, selected_params))
+        except Exception as e:
+            logger.error(f"Error submitting batch job: {e}")
+            return jsonify({'error': f"Error submitting batch job: {str(e)}"}), 500
 
-            table_data.append(row)
+        logger.info(f"[analyzeManyCvsTableWithParams] Submitted batch {batch.id} with {len(cv_texts) - len(failed)} CVs")
+        return json_response({'batch_id': batch.id, 'status': batch.status, 'table_data': failed_rows}), 202
 
-        except Exception as e:
-            logger.error(f"Error processing {file.filename}: {e}")
-            row = {'cv_name': file.filename, 'error': str(e)}
-            for param in selected_params:
-                row[param] = 'Error'
-            table_data.append(row)
-        finally:
-            end_time = time.time()
-            duration = end_time - start_time
-            logger.info(f"[analyzeManyCvsTableWithParams] {file.filename} processed in {duration:.2f} seconds")
+    feedbacks = run_async(compare_many_cvs(job_description, cv_texts, selected_params))
+    table_data = build_table_rows(cv_names, feedbacks, selected_params)
+
+    duration = time.time() - start_time
+    logger.info(f"[analyzeManyCvsTableWithParams] {len(files)} CVs processed in {duration:.2f} seconds")
+
+    return json_response({'table_data': table_data}), 200
+
+
+@application.route('/batchResult/<batch_id>', methods=['GET'])
+def batch_result(batch_id):
+    """
+    Poll a batch job submitted with /analyzeManyCvsTableWithParams?batch=true.
+    Returns the job status, plus the table rows once the job has completed.
+    """
+    try:
+        batch = run_async(client.batches.retrieve(batch_id))
+    except openai.NotFoundError:
+        return jsonify({'error': 'Unknown batch'}), 404
+    except Exception as e:
+        logger.error(f"Error retrieving batch {batch_id}: {e}")
+        return jsonify({'error': f"Error retrieving batch: {str(e)}"}), 500
+
+    if batch.status != 'completed':
+        return json_response({'batch_id': batch.id, 'status': batch.status}), 200
+
+    try:
+        table_data = run_async(fetch_batch_results(batch))
+    except Exception as e:
+        logger.error(f"Error reading results of batch {batch_id}: {e}")
+        return jsonify({'error': f"Error reading batch results: {str(e)}"}), 500
 
-    return jsonify({'table_data': table_data}), 200
+    return json_response({'batch_id': batch.id, 'status': batch.status, 'table_data': table_data}), 200
 
 
 # -------------------- MAIN --------------------
 if __name__ == '__main__':
-    application.run(debug=True, port=4780)
+    # Spawned PDF extraction workers re-run the main module, so running this file
+    # directly would load the whole app in each of them
+    raise SystemExit("Start the development server with: python dev_server.py")
@@ -0,0 +1,10 @@
+# Local development server; production runs under gunicorn (see gunicorn.conf.py).
+# Run from the backend folder with:
+#   python dev_server.py
+# The app is imported only under the __main__ guard: spawned PDF extraction
+# workers re-run this script as their main module, and must not load the app.
+import os
+
+if __name__ == '__main__':
+    from application import application
+    application.run(debug=os.getenv("FLASK_DEBUG") == "1", port=4780)
@@ -0,0 +1,37 @@
+# Production server config. Run from the backend folder with:
+#   gunicorn application:application
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '4780')}"
+
+# A few processes, each serving requests on a pool of threads. Bulk requests
+# spend most of their time waiting on OpenAI, which happens on each worker's
+# background event loop, so threads rather than extra processes overlap
+# concurrent uploads.
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = 16
+
+# Each worker enforces its own OpenAI rate limits and runs its own PDF extraction
+# pool, so the account limits and the CPUs are divided between the workers.
+# Set OPENAI_ACCOUNT_RPM/OPENAI_ACCOUNT_TPM to the account's gpt-4o-mini limits.
+# The shares are worked out once the final worker count is known (including -w on
+# the command line), and GPT_REQUESTS_PER_MINUTE, GPT_TOKENS_PER_MINUTE or
+# PDF_EXTRACTION_WORKERS set by the operator are left as they are.
+def on_starting(server):
+    worker_count = server.cfg.workers
+    account_rpm = int(os.getenv("OPENAI_ACCOUNT_RPM", "500"))
+    account_tpm = int(os.getenv("OPENAI_ACCOUNT_TPM", "200000"))
+    os.environ.setdefault("GPT_REQUESTS_PER_MINUTE", str(max(1, account_rpm // worker_count)))
+    os.environ.setdefault("GPT_TOKENS_PER_MINUTE", str(max(1, account_tpm // worker_count)))
+    os.environ.setdefault(
+        "PDF_EXTRACTION_WORKERS", str(max(1, multiprocessing.cpu_count() // worker_count))
+    )
+
+# Each worker must import the app itself: the background event loop thread
+# started at import time would not survive a fork from a preloaded master.
+preload_app = False
+
+# Analyzing a batch of CVs can take well over gunicorn's 30s default
+timeout = 180
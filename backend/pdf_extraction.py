@@ -0,0 +1,18 @@
+# PDF text extraction run by the page extraction worker processes. Kept apart from
+# application.py so that unpickling these functions in a spawned worker only imports
+# pypdfium2, not the whole app (as long as the app isn't the main module, see
+# dev_server.py).
+import pypdfium2 as pdfium
+
+# Read the text of pages [start, stop) from an open PDF document
+def read_pages(pdf, start, stop):
+    return [pdf[i].get_textpage().get_text_bounded() for i in range(start, stop)]
+
+# Extract the text of pages [start, stop) of a PDF. Runs in a worker process,
+# which has its own PDFium instance and so needs no lock.
+def extract_page_range(pdf_bytes, start, stop):
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        return read_pages(pdf, start, stop)
+    finally:
+        pdf.close()